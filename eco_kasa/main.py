@@ -1,11 +1,30 @@
 from argparse import ArgumentParser, Action, Namespace
 from enum import Enum
-from io import TextIOWrapper
 from kasa import Discover, SmartDevice, SmartDeviceException
 from pathlib import Path
-from tabulate import tabulate
-from typing import Dict, List, Optional
-import asyncio, json, netifaces, nmap, platform, subprocess
+from typing import (
+  Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar, Union
+)
+import asyncio, atexit, functools, ipaddress, json, pickle, socket, sys, time
+
+T = TypeVar("T")
+
+CONFIG_PATH: Path = Path("./config.json")
+
+# The address connected to when checking for an Internet connection (Google's
+# DNS servers), and how long (in seconds) to wait on it.
+INTERNET_CHECK_ADDRESS: Tuple[str, int] = ("8.8.8.8", 53)
+INTERNET_CHECK_TIMEOUT: float = 2
+
+# Where the results of discovery are cached between runs, and how long (in
+# seconds) they stay valid for.
+CACHE_PATH: Path = Path.home() / ".cache" / "eco_kasa" / "devices.pkl"
+CACHE_MAX_AGE: float = 24 * 60 * 60
+
+# A cached config target's last known alias, or None if it couldn't be
+# discovered at the time. Devices are always reached through the target itself,
+# so there's no separate IP to remember.
+CachedDevice = Optional[str]
 
 class Operation(Enum):
   TurnOn = "turn_on"
@@ -14,24 +33,14 @@ class Operation(Enum):
   SetAlias = "set_alias"
   Update = "update"
   UpdateOne = "update_one"
+  Refresh = "refresh"
+
+# Every operation, keyed by its string form.
+OPERATIONS: Dict[str, Operation] = {op.value: op for op in Operation}
 
 def operation_from_str(s: str) -> Optional[Operation]:
   """ Returns an operation from the corresponding string. """
-  as_lower: str = s.lower()
-  if as_lower == Operation.TurnOn.value:
-    return Operation.TurnOn
-  elif as_lower == Operation.TurnOff.value:
-    return Operation.TurnOff
-  elif as_lower == Operation.ListDevices.value:
-    return Operation.ListDevices
-  elif as_lower == Operation.SetAlias.value:
-    return Operation.SetAlias
-  elif as_lower == Operation.Update.value:
-    return Operation.Update
-  elif as_lower == Operation.UpdateOne.value:
-    return Operation.UpdateOne
-  else:
-    return None
+  return OPERATIONS.get(s.lower())
 
 def init_parser() -> ArgumentParser:
   """ Initializes the argument parser. """
@@ -42,7 +51,8 @@ def init_parser() -> ArgumentParser:
   subparsers: Action = parser.add_subparsers(
     dest="operation",
     help="The operation to perform. Must be one of:"
-      + " \"turn_on\", \"turn_off\", \"list\", \"set_alias\", or \"update\"."
+      + " \"turn_on\", \"turn_off\", \"list\", \"set_alias\", \"update\","
+      + " \"update_one\", or \"refresh\"."
   )
   subparsers.required = True
 
@@ -78,18 +88,19 @@ def init_parser() -> ArgumentParser:
     help="The target smart device. Can be either the device's IP or its alias."
   )
 
+  subparsers.add_parser("refresh")
+
   return parser
 
 class Config:
-  def __init__(self, targets: List[str]) -> None:
-    self.__targets: List[str] = targets
+  __slots__ = ("targets",)
 
-  def get_targets(self) -> List[str]:
-    return self.__targets
+  def __init__(self, targets: List[str]) -> None:
+    self.targets: List[str] = targets
 
   def as_dict(self) -> Dict[str, List[str]]:
     as_dict: Dict[str, List[str]] = {}
-    as_dict["targets"] = self.__targets
+    as_dict["targets"] = self.targets
     return as_dict
 
 def config_default() -> Config:
@@ -98,168 +109,396 @@ def config_default() -> Config:
 def config_from_dict(d: Dict[str, List[str]]) -> Config:
   return Config(d["targets"])
 
+async def discover_targets(
+  targets: List[str]
+) -> List[Union[SmartDevice, BaseException]]:
+  """
+  Discovers all of the given targets concurrently. Targets that failed to be
+  discovered have their exception returned in place of a device.
+  """
+  return await asyncio.gather(
+    *[
+      asyncio.create_task(Discover.discover_single(target))
+      for target in targets
+    ],
+    return_exceptions=True
+  )
+
+@functools.lru_cache(maxsize=1)
+def default_gateway_prefix() -> str:
+  """
+  Returns the first three octets of the default gateway's IP (e.g. "192.168.0"),
+  which is only looked up once per run.
+  """
+  # Only needed here, so it isn't imported until a scan actually happens.
+  import netifaces
+
+  # Borrowed this part from https://stackoverflow.com/questions/2761829/python-get-default-gateway-for-a-local-interface-ip-address-in-linux/6556951
+  default_gateway: str = netifaces.gateways()["default"][netifaces.AF_INET][0]
+  return ".".join(default_gateway.split(".")[:-1])
+
+async def probe_hosts(
+  hosts: List[str], limit: int = 64, timeout: float = 2.0
+) -> List[Optional[Tuple[str, SmartDevice]]]:
+  """
+  Probes all of the given hosts concurrently, with at most the given limit in
+  flight at once. Hosts that aren't smart devices, didn't respond within the
+  timeout, or answered with something python-kasa couldn't make sense of are
+  returned as None.
+  """
+  semaphore: asyncio.Semaphore = asyncio.Semaphore(limit)
+
+  async def probe(host: str) -> Optional[Tuple[str, SmartDevice]]:
+    async with semaphore:
+      try:
+        return host, await asyncio.wait_for(
+          Discover.discover_single(host), timeout
+        )
+      except Exception:
+        # Anything on the subnet can answer, so one odd host mustn't stop the
+        # whole scan.
+        return None
+
+  return await asyncio.gather(*[probe(host) for host in hosts])
+
+async def bulk_update(
+  devices: List[SmartDevice], turn_on: bool
+) -> List[Tuple[SmartDevice, BaseException]]:
+  """
+  Concurrently turns on (or off) every given device that isn't already on (or
+  off). Returns the devices that failed, along with what went wrong.
+  """
+  to_update: List[SmartDevice] = [
+    device for device in devices if (device.is_off if turn_on else device.is_on)
+  ]
+  results: List[Any] = await asyncio.gather(
+    *[
+      device.turn_on() if turn_on else device.turn_off()
+      for device in to_update
+    ],
+    return_exceptions=True
+  )
+  return [
+    (device, result) for device, result in zip(to_update, results)
+    if isinstance(result, BaseException)
+  ]
+
+def is_ip(s: str) -> bool:
+  """ Returns whether the given string is an IP address. """
+  try:
+    ipaddress.ip_address(s)
+    return True
+  except ValueError:
+    return False
+
 class Application:
   def __init__(self) -> None:
     self.__config: Config = self.load_config()
     self.__devices: Dict[str, SmartDevice] = {}
-    self.discover_devices_config()
+    # The same devices as above, but keyed by their aliases instead.
+    self.__by_alias: Dict[str, SmartDevice] = {}
+    self.__has_internet: Optional[bool] = None
+    # A single loop is kept around for the whole run instead of spinning up a
+    # new one for every call.
+    self.__loop: asyncio.AbstractEventLoop = asyncio.new_event_loop()
+    atexit.register(self.__loop.close)
+    # Config targets that were found in the cache, but haven't been turned into
+    # devices yet, mapped to their last known alias.
+    self.__cached: Dict[str, CachedDevice] = {}
+    # When the cached devices were last discovered in full. Partial updates to
+    # the cache keep this as is, so that it still expires on time.
+    self.__cache_time: float = 0
+    # Discovery is put off until something actually needs every target, since
+    # a target given as an IP can be reached without it.
+    maybe_cache: Optional[Tuple[float, Dict[str, CachedDevice]]] = (
+      self.load_cache()
+    )
+    self.__discovered: bool = maybe_cache != None
+    if maybe_cache != None:
+      maybe_cache: Tuple[float, Dict[str, CachedDevice]]
+      self.__cache_time, self.__cached = maybe_cache
+
+  def __run(self, coro: Awaitable[T]) -> T:
+    """ Runs the given coroutine to completion on this application's loop. """
+    return self.__loop.run_until_complete(coro)
 
   def load_config(self) -> Config:
-    if Path("./config.json").is_file():
-      file: TextIOWrapper = open("./config.json", "r")
-      targets: List[str] = Config(json.loads(file.read())["targets"])
-      file.close()
-      return targets
+    if CONFIG_PATH.is_file():
+      return config_from_dict(json.loads(CONFIG_PATH.read_bytes()))
     else:
       print("No config.json found, writing a new one.")
-      file: TextIOWrapper = open("./config.json", "w")
-      json.dump(config_default().as_dict(), file)
-      file.close()
+      CONFIG_PATH.write_text(json.dumps(config_default().as_dict(), indent=2))
       print(
         "Config written. Please edit it with your target IPs and/or aliases."
         + " and rerun the script."
       )
       exit()
 
+  def load_cache(self) -> Optional[Tuple[float, Dict[str, CachedDevice]]]:
+    """
+    Loads the devices cached by a previous run, along with when they were
+    discovered. Returns None if there's no usable cache, or if it's too old or
+    doesn't cover every target in the config.
+    """
+    if not CACHE_PATH.is_file():
+      return None
+    try:
+      cache: Dict[str, Any] = pickle.loads(CACHE_PATH.read_bytes())
+      cache_time: float = float(cache["time"])
+      devices: Dict[str, CachedDevice] = dict(cache["devices"])
+      for alias in devices.values():
+        if alias != None and not isinstance(alias, str):
+          return None
+    except Exception:
+      # Anything could be in there, so any failure just means there's no cache.
+      return None
+    if (
+      time.time() - cache_time > CACHE_MAX_AGE
+      or set(devices) != set(self.__config.targets)
+    ):
+      return None
+    return cache_time, devices
+
+  def save_cache(self) -> None:
+    """
+    Caches the alias of every config target for the next run. Targets
+    that couldn't be discovered are cached as None so that they're retried.
+    """
+    devices: Dict[str, CachedDevice] = {}
+    for target in self.__config.targets:
+      if target in self.__devices:
+        devices[target] = self.__devices[target].alias
+      else:
+        devices[target] = self.__cached.get(target)
+    try:
+      CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+      CACHE_PATH.write_bytes(pickle.dumps({
+        "time": self.__cache_time,
+        "devices": devices
+      }))
+    except OSError as e:
+      print(
+        f"Was unable to write the device cache to {CACHE_PATH}: {e}",
+        file=sys.stderr
+      )
+
+  def load_cached_devices(self, targets: List[str]) -> None:
+    """ Creates devices for the given cached targets. """
+    for target in targets:
+      self.__cached.pop(target)
+    self.discover_devices(targets)
+
+  def ensure_discovered(self) -> None:
+    """ Discovers every config target, unless that's already been done. """
+    if not self.__discovered:
+      self.discover_devices_config()
+      self.__cache_time = time.time()
+      self.save_cache()
+      self.__discovered = True
+
+  def refresh(self) -> None:
+    """ Discovers every config target again, ignoring the cache. """
+    self.__discovered = False
+    self.ensure_discovered()
+    print("Refreshed the cached devices.")
+
   def discover_devices_config(self) -> None:
-    for target in self.__config.get_targets():
-      try:
-        self.__devices[target] = asyncio.run(Discover.discover_single(target))
-      except SmartDeviceException:
+    self.__cached = {}
+    self.discover_devices(self.__config.targets)
+
+  def discover_devices(self, targets: List[str]) -> None:
+    """ Discovers the given targets from scratch. """
+    results: List[Union[SmartDevice, BaseException]] = self.__run(
+      discover_targets(targets)
+    )
+    for target, result in zip(targets, results):
+      if isinstance(result, SmartDeviceException):
         print(
-          "Was unable to create a smart device from target "
-          + target + ", skipping."
+          f"Was unable to create a smart device from target {target}, skipping.",
+          file=sys.stderr
         )
-        pass
+      elif isinstance(result, BaseException):
+        raise result
+      else:
+        self.add_device(target, result)
 
-  def discover_devices_nmap(self) -> None:
+  def discover_devices_network(self) -> None:
     """
-    Discovers the devices that exist on the local network, but using nmap instead
-    since python-kasa's implementation of discovery doesn't work too well...
+    Discovers the devices that exist on the local network by probing every
+    address in the default gateway's /24 directly, since python-kasa's
+    implementation of discovery doesn't work too well...
     """
-    # Borrowed this part from https://stackoverflow.com/questions/2761829/python-get-default-gateway-for-a-local-interface-ip-address-in-linux/6556951
-    default_gateway: str = netifaces.gateways()["default"][netifaces.AF_INET][0]
-    parts: List[str] = default_gateway.split(".")
-    parts[-1] = str(0)
-    to_check: str = ".".join(parts) + "/24"
-
-    # Borrowing this from python-nmap's documentation
-    nm: nmap.PortScanner = nmap.PortScanner()
-    print("Currently scanning the network using nmap...")
-    nm.scan(to_check, arguments = "-sn")
-    print("Finished scanning.")
-
-    for host in nm.all_hosts():
-      try:
-        self.__devices[host] = asyncio.run(Discover.discover_single(host))
-      except SmartDeviceException:
-        print(
-          "Was unable to create a smart device from host "
-          + host + ", skipping."
-        )
-        pass
+    prefix: str = default_gateway_prefix()
+    hosts: List[str] = [f"{prefix}.{i}" for i in range(1, 255)]
+
+    print("Currently scanning the network...")
+    results: List[Optional[Tuple[str, SmartDevice]]] = self.__run(
+      probe_hosts(hosts)
+    )
+    skipped: int = 0
+    for result in results:
+      if result == None:
+        skipped += 1
+      else:
+        host, device = result
+        self.add_device(host, device)
+    print(
+      f"Finished scanning, skipped {skipped} hosts that weren't smart devices."
+    )
+
+  def add_device(self, target: str, device: SmartDevice) -> None:
+    """ Adds a device under the given target, and under its alias as well. """
+    self.__devices[target] = device
+    self.__by_alias[device.alias] = device
 
   def get_device(self, target: str) -> Optional[SmartDevice]:
     """
     Retrieves a device corresponding with the given target. The target can either
     be the device's IP or alias.
     """
-    if target in self.__devices:
-      return self.__devices[target]
-    else:
-      for _, device in self.__devices.items():
-        if target == device.alias:
-          return device
-      return None
+    maybe_device: Optional[SmartDevice] = (
+      self.__devices.get(target) or self.__by_alias.get(target)
+    )
+    if maybe_device != None:
+      return maybe_device
+
+    for cached_target, alias in self.__cached.items():
+      if target in (cached_target, alias):
+        self.load_cached_devices([cached_target])
+        return self.__devices.get(cached_target)
+
+    # If the target is an IP, it can be reached directly instead of discovering
+    # every target in the config just to find it.
+    if is_ip(target):
+      try:
+        return self.__run(Discover.discover_single(target))
+      except SmartDeviceException:
+        return None
+
+    self.ensure_discovered()
+    maybe_device = self.__devices.get(target) or self.__by_alias.get(target)
+    if maybe_device == None and len(self.__cached) > 0:
+      # The alias might've changed since the cache was written, or the device
+      # might've been unreachable back then, so check every device's live alias.
+      self.load_cached_devices(list(self.__cached))
+      self.save_cache()
+      maybe_device = self.__by_alias.get(target)
+    return maybe_device
+
+  def get_devices(self) -> Dict[str, SmartDevice]:
+    """ Retrieves every device, creating any that are still only cached. """
+    self.ensure_discovered()
+    if len(self.__cached) > 0:
+      self.load_cached_devices(list(self.__cached))
+    return self.__devices
 
   def try_turn_on(self, target: str) -> None:
     """ Attempts to turn on the target device. """
     maybe_device: Optional[SmartDevice] = self.get_device(target)
     if maybe_device == None:
-      print("No devices with the given IP or alias were found.")
+      print(
+        "No devices with the given IP or alias were found.", file=sys.stderr
+      )
     else:
       maybe_device: SmartDevice
       if maybe_device.is_off:
-        asyncio.run(maybe_device.turn_on())
+        self.__run(maybe_device.turn_on())
 
   def try_turn_off(self, target: str) -> None:
     """ Attempts to turn off the target device. """
     maybe_device: Optional[SmartDevice] = self.get_device(target)
     if maybe_device == None:
-      print("No devices with the given IP or alias were found.")
+      print(
+        "No devices with the given IP or alias were found.", file=sys.stderr
+      )
     else:
       maybe_device: SmartDevice
       if maybe_device.is_on:
-        asyncio.run(maybe_device.turn_off())
+        self.__run(maybe_device.turn_off())
 
   def list_devices(self) -> None:
     """ Lists all devices out in a simple table. """
-    table: List[List[str]] = []
-    for addr, device in self.__devices.items():
-      table.append([addr, device.alias, str(device.is_on)])
+    from tabulate import tabulate
+
+    table: List[List[str]] = [
+      [addr, device.alias, str(device.is_on)]
+      for addr, device in self.get_devices().items()
+    ]
     print(tabulate(table, ["IP", "Alias", "Is on?"]))
 
   def try_set_alias(self, target: str, new_alias: str) -> None:
     """ Attempts to set the alias of the target device. """
     maybe_device: Optional[SmartDevice] = self.get_device(target)
     if maybe_device == None:
-      print("No devices with the given IP or alias were found.")
+      print(
+        "No devices with the given IP or alias were found.", file=sys.stderr
+      )
     else:
       maybe_device: SmartDevice
-      asyncio.run(maybe_device.set_alias(new_alias))
+      old_alias: str = maybe_device.alias
+      self.__run(maybe_device.set_alias(new_alias))
+      # Setting the alias doesn't update the device's state on its own.
+      self.__run(maybe_device.update())
+      if self.__by_alias.get(old_alias) is maybe_device:
+        self.__by_alias.pop(old_alias)
+        self.__by_alias[maybe_device.alias] = maybe_device
+      # Only a cache that covers every target is worth writing.
+      if self.__discovered:
+        self.save_cache()
 
-  def computer_has_internet(self):
+  def computer_has_internet(self) -> bool:
     """
-    Pings Google's servers to see if this computer has an Internet connection.
+    Connects to Google's DNS servers to see if this computer has an Internet
+    connection. The answer is only checked once per run.
     """
-    # Borrowed from https://stackoverflow.com/questions/2953462/pinging-servers-in-python 
-    response: int = subprocess.call(
-      [
-        "ping",
-        ("-n" if platform.system().lower() == "windows" else "-c"),
-        "1",
-        "8.8.8.8"
-      ],
-      stdout = subprocess.DEVNULL,
-      stderr = subprocess.STDOUT
-    )
-    return response == 0
+    if self.__has_internet == None:
+      try:
+        socket.create_connection(
+          INTERNET_CHECK_ADDRESS, timeout=INTERNET_CHECK_TIMEOUT
+        ).close()
+        self.__has_internet = True
+      except OSError:
+        self.__has_internet = False
+    return self.__has_internet
 
   def try_update(self) -> None:
-    if self.computer_has_internet():
-      for _, device in self.__devices.items():
-        if device.is_off:
-          asyncio.run(device.turn_on())
-    else:
-      for _, device in self.__devices.items():
-        if device.is_on:
-          asyncio.run(device.turn_off()) 
+    devices: List[SmartDevice] = list(self.get_devices().values())
+    failed: List[Tuple[SmartDevice, BaseException]] = self.__run(
+      bulk_update(devices, self.computer_has_internet())
+    )
+    for device, error in failed:
+      if isinstance(error, SmartDeviceException):
+        print(
+          f"Was unable to update {device.alias}, skipping.", file=sys.stderr
+        )
+      else:
+        raise error
 
   def try_update_one(self, target: str) -> None:
     maybe_device: Optional[SmartDevice] = self.get_device(target)
     if maybe_device == None:
-      print("No devices with the given IP or alias were found.")
-    else:
-      maybe_device: SmartDevice
-      if self.computer_has_internet():
-        if maybe_device.is_off:
-          asyncio.run(maybe_device.turn_on())
-      else:
-        if maybe_device.is_on:
-          asyncio.run(maybe_device.turn_on())
+      print(
+        "No devices with the given IP or alias were found.", file=sys.stderr
+      )
+      return
+    maybe_device: SmartDevice
+    online: bool = self.computer_has_internet()
+    if online and maybe_device.is_off:
+      self.__run(maybe_device.turn_on())
+    elif not online and maybe_device.is_on:
+      self.__run(maybe_device.turn_off())
 
 def main():
-  app: Application = Application()
   args: Namespace = init_parser().parse_args()
-  if args.operation == Operation.TurnOn.value:
-    app.try_turn_on(args.target)
-  elif args.operation == Operation.TurnOff.value:
-    app.try_turn_off(args.target)
-  elif args.operation == Operation.ListDevices.value:
-    app.list_devices()
-  elif args.operation == Operation.SetAlias.value:
-    app.try_set_alias(args.target, args.new_alias)
-  elif args.operation == Operation.Update.value:
-    app.try_update()
-  elif args.operation == Operation.UpdateOne.value:
-    app.try_update_one(args.target)
\ No newline at end of file
+  operation: Optional[Operation] = operation_from_str(args.operation)
+  app: Application = Application()
+  handlers: Dict[Operation, Callable[[Namespace], None]] = {
+    Operation.TurnOn: lambda a: app.try_turn_on(a.target),
+    Operation.TurnOff: lambda a: app.try_turn_off(a.target),
+    Operation.ListDevices: lambda a: app.list_devices(),
+    Operation.SetAlias: lambda a: app.try_set_alias(a.target, a.new_alias),
+    Operation.Update: lambda a: app.try_update(),
+    Operation.UpdateOne: lambda a: app.try_update_one(a.target),
+    Operation.Refresh: lambda a: app.refresh()
+  }
+  handlers[operation](args)
@@ -0,0 +1,53 @@
+import json
+
+import pytest
+from kasa import SmartDeviceException
+
+from eco_kasa import main
+
+
+class FakeDevice:
+    def __init__(self, host):
+        self.host = host
+        self.alias = "alias-" + host
+        self.is_on = False
+        # The alias the device itself holds, which only shows up in alias
+        # after an update(), like a real device.
+        self.remote_alias = self.alias
+
+    @property
+    def is_off(self):
+        return not self.is_on
+
+    async def turn_on(self):
+        self.is_on = True
+
+    async def turn_off(self):
+        self.is_on = False
+
+    async def set_alias(self, alias):
+        self.remote_alias = alias
+
+    async def update(self):
+        self.alias = self.remote_alias
+
+
+@pytest.fixture
+def network(tmp_path, monkeypatch):
+    """ Points the config and cache at tmp_path and stubs out discovery. """
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps({"targets": ["10.0.0.1", "10.0.0.2"]}))
+    monkeypatch.setattr(main, "CONFIG_PATH", config_path)
+    monkeypatch.setattr(main, "CACHE_PATH", tmp_path / "cache" / "devices.pkl")
+
+    calls = []
+    offline = set()
+
+    async def discover_single(host):
+        calls.append(host)
+        if host in offline:
+            raise SmartDeviceException("offline")
+        return FakeDevice(host)
+
+    monkeypatch.setattr(main.Discover, "discover_single", discover_single)
+    return calls, offline
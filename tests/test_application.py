@@ -0,0 +1,32 @@
+from eco_kasa import main
+
+
+def test_try_update_one_turns_off_when_offline(network, monkeypatch):
+    monkeypatch.setattr(
+        main.Application, "computer_has_internet", lambda self: False
+    )
+    app = main.Application()
+    device = app.get_devices()["10.0.0.1"]
+    device.is_on = True
+    app.try_update_one("10.0.0.1")
+    assert device.is_off
+
+
+def test_try_update_one_turns_on_when_online(network, monkeypatch):
+    monkeypatch.setattr(
+        main.Application, "computer_has_internet", lambda self: True
+    )
+    app = main.Application()
+    device = app.get_devices()["10.0.0.1"]
+    app.try_update_one("10.0.0.1")
+    assert device.is_on
+
+
+def test_try_set_alias_reindexes_device(network):
+    app = main.Application()
+    device = app.get_devices()["10.0.0.1"]
+    app.try_set_alias("alias-10.0.0.1", "lamp")
+    assert device.alias == "lamp"
+    assert app.get_device("lamp") is device
+    assert app.get_device("alias-10.0.0.1") is None
+    assert main.Application().load_cache()[1]["10.0.0.1"] == "lamp"
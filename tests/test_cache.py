@@ -0,0 +1,119 @@
+import json
+import pickle
+import time
+
+import pytest
+
+from eco_kasa import main
+
+
+def write_cache(cache):
+    main.CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    main.CACHE_PATH.write_bytes(pickle.dumps(cache))
+
+
+def test_load_cache_missing(network):
+    assert main.Application().load_cache() is None
+
+
+def test_load_cache_stale(network):
+    write_cache({
+        "time": time.time() - main.CACHE_MAX_AGE - 1,
+        "devices": {"10.0.0.1": None, "10.0.0.2": None}
+    })
+    assert main.Application().load_cache() is None
+
+
+def test_load_cache_mismatched_targets(network):
+    write_cache({"time": time.time(), "devices": {"10.0.0.1": None}})
+    assert main.Application().load_cache() is None
+
+
+@pytest.mark.parametrize("contents", [
+    b"not a pickle",
+    pickle.dumps(["x"]),
+    pickle.dumps({"time": "now", "devices": {}}),
+    pickle.dumps({
+        "time": time.time(), "devices": {"10.0.0.1": 5, "10.0.0.2": None}
+    })
+])
+def test_load_cache_corrupt(network, contents):
+    main.CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    main.CACHE_PATH.write_bytes(contents)
+    app = main.Application()
+    assert app.load_cache() is None
+    assert set(app.get_devices()) == {"10.0.0.1", "10.0.0.2"}
+
+
+def test_save_cache_round_trip(network):
+    main.Application().get_devices()
+    cache_time, devices = main.Application().load_cache()
+    assert time.time() - cache_time < 60
+    assert devices == {
+        "10.0.0.1": "alias-10.0.0.1",
+        "10.0.0.2": "alias-10.0.0.2"
+    }
+
+
+def test_failed_target_is_retried_next_run(network):
+    calls, offline = network
+    offline.add("10.0.0.2")
+    assert set(main.Application().get_devices()) == {"10.0.0.1"}
+    assert main.Application().load_cache()[1]["10.0.0.2"] is None
+
+    offline.clear()
+    calls.clear()
+    assert set(main.Application().get_devices()) == {"10.0.0.1", "10.0.0.2"}
+    assert sorted(calls) == ["10.0.0.1", "10.0.0.2"]
+
+
+def test_load_cached_devices_probes_failures_once(network):
+    calls, offline = network
+    main.Application().get_devices()
+    offline.add("10.0.0.2")
+    calls.clear()
+    assert set(main.Application().get_devices()) == {"10.0.0.1"}
+    assert calls.count("10.0.0.2") == 1
+
+
+def test_save_cache_unwritable(network, monkeypatch, tmp_path, capsys):
+    blocker = tmp_path / "blocker"
+    blocker.write_text("")
+    monkeypatch.setattr(main, "CACHE_PATH", blocker / "devices.pkl")
+    assert set(main.Application().get_devices()) == {"10.0.0.1", "10.0.0.2"}
+    assert "Was unable to write the device cache" in capsys.readouterr().err
+
+
+def test_get_device_finds_alias_missing_from_cache(network):
+    calls, _ = network
+    write_cache({
+        "time": time.time(),
+        "devices": {
+            "10.0.0.1": "alias-10.0.0.1",
+            "10.0.0.2": "renamed elsewhere"
+        }
+    })
+    device = main.Application().get_device("alias-10.0.0.2")
+    assert device is not None and device.host == "10.0.0.2"
+    assert main.Application().load_cache()[1]["10.0.0.2"] == "alias-10.0.0.2"
+
+
+def test_get_device_finds_alias_of_previously_failed_target(network):
+    calls, offline = network
+    offline.add("10.0.0.2")
+    main.Application().get_devices()
+    offline.clear()
+    assert main.Application().get_device("alias-10.0.0.2") is not None
+
+
+def test_get_device_unknown_alias_writes_cache_once(network, monkeypatch):
+    calls, _ = network
+    saves = []
+    save_cache = main.Application.save_cache
+    monkeypatch.setattr(
+        main.Application, "save_cache",
+        lambda self: (saves.append(1), save_cache(self))
+    )
+    assert main.Application().get_device("typo") is None
+    assert len(saves) == 1
+    assert sorted(calls) == ["10.0.0.1", "10.0.0.2"]